@@ -15,6 +15,7 @@ VirtualCrypto Standalone Bot
 
 必要パッケージ:
   pip install -U discord.py aiosqlite python-dotenv
+  （Pythonに組み込まれたSQLiteは3.35以上が必要）
 
 環境変数設定:
   DISCORD_TOKEN=your_bot_token_here
@@ -23,10 +24,13 @@ VirtualCrypto Standalone Bot
 """
 
 import os
+import time
 import asyncio
+import sqlite3
 import aiosqlite
-from decimal import Decimal, InvalidOperation, ROUND_DOWN
-from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from decimal import Decimal, InvalidOperation, ROUND_DOWN, ROUND_HALF_EVEN
 from typing import Optional, List, Tuple, Dict, Any
 
 import discord
@@ -41,433 +45,841 @@ except ImportError:
     print("Warning: python-dotenv not installed. Environment variables must be set manually.")
 
 # 設定
-TZ = timezone(timedelta(hours=9))  # 日本標準時（JST）
 # このスクリプトと同じフォルダにDBを作成
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.getenv("VC_DB", os.path.join(SCRIPT_DIR, "vc_ledger.sqlite3"))
 DEFAULT_DECIMALS = 2
+MAX_DECIMALS = 8
+# 金額（最小単位）はSQLiteのINTEGER（符号付き64bit）に収める
+MAX_UNITS = 2**63 - 1
+# スキーマを変更したら上げる（PRAGMA user_version と比較して移行の要否を判定）
+SCHEMA_VERSION = 6
+# INSERT ... RETURNING を使うため SQLite 3.35 以上が必要
+MIN_SQLITE_VERSION = (3, 35, 0)
+# sqlite3のプリペアドステートメントキャッシュ（SQL文字列ごとに解析結果を再利用）
+STATEMENT_CACHE_SIZE = 256
 
 # ========================== データベース設定 ==========================
 
-async def ensure_db():
-    """データベースの初期化"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # 既存のテーブルのスキーマを確認し、必要に応じて修正
+# Bot起動時に一度だけ開き、全コマンドで共有するDB接続
+DB: Optional[aiosqlite.Connection] = None
+# 共有接続上の書き込みトランザクションを直列化するロック
+DB_LOCK = asyncio.Lock()
+_in_transaction: ContextVar[bool] = ContextVar("_in_transaction", default=False)
+
+async def open_db() -> aiosqlite.Connection:
+    """共有DB接続を開き、PRAGMAを設定してスキーマを初期化"""
+    # 古いSQLiteでは送金・通貨作成が全て失敗するため、起動時に明確なエラーにする
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = ".".join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(f"SQLite {required} 以上が必要です（現在: {sqlite3.sqlite_version}）。")
+    # トランザクションは transaction() で明示的に管理する
+    db = await aiosqlite.connect(DB_PATH, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+    # ネットワークファイルシステム等ではWALにできないため、実際のモードを確認する
+    journal_mode = (await fetch_one(db, "PRAGMA journal_mode=WAL"))[0]
+    if journal_mode.lower() != "wal":
+        print(f"[DB] WAL unavailable, journal_mode={journal_mode}")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-64000")
+    await db.execute("PRAGMA mmap_size=268435456")
+    await db.execute("PRAGMA busy_timeout=30000")
+    # SQLiteのlower()はASCIIのみ対応のため、通貨名の検索にはPythonのstr.lowerを使う
+    await db.create_function("py_lower", 1, str.lower, deterministic=True)
+    try:
+        await ensure_db(db)
+    except BaseException:
+        # 接続を閉じないとaiosqliteのスレッドが残り、プロセスが終了しない
+        await db.close()
+        raise
+    # 移行でテーブルを作り直すため、外部キー制約はスキーマ初期化後に有効化する
+    await db.execute("PRAGMA foreign_keys=ON")
+    return db
+
+@asynccontextmanager
+async def transaction(db):
+    """BEGIN IMMEDIATE〜COMMITで囲む（例外時はROLLBACK、ネスト時は外側に合流）"""
+    if _in_transaction.get():
+        yield db
+        return
+    
+    async with DB_LOCK:
+        token = _in_transaction.set(True)
         try:
-            # assetsテーブルの情報を取得してcreated_atカラムの存在を確認
-            cursor = await db.execute("PRAGMA table_info(assets)")
-            columns = await cursor.fetchall()
-            column_names = [col[1] for col in columns]
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                await db.execute("COMMIT")
+            except BaseException:
+                await db.execute("ROLLBACK")
+                raise
+        finally:
+            _in_transaction.reset(token)
+
+async def close_db():
+    """共有DB接続を閉じる"""
+    global DB
+    if DB is not None:
+        await DB.close()
+        DB = None
+
+async def ensure_db(db):
+    """データベースの初期化（スキーマが最新なら何もしない）"""
+    version = (await fetch_one(db, "PRAGMA user_version"))[0]
+    if version >= SCHEMA_VERSION:
+        return
+    
+    async with transaction(db):
+        await _migrate_db(db)
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
+    # スキーマ変更後にクエリプランナー用の統計を更新
+    await db.execute("ANALYZE")
+
+async def _migrate_db(db):
+    """スキーマの作成・移行"""
+    # 既存のテーブルのスキーマを確認し、必要に応じて修正
+    try:
+        # assetsテーブルの情報を取得してcreated_atカラムの存在を確認
+        cursor = await db.execute("PRAGMA table_info(assets)")
+        columns = await cursor.fetchall()
+        column_names = [col[1] for col in columns]
+        
+        # created_atカラムが存在する場合は削除（新しいスキーマに合わせる）
+        if 'created_at' in column_names:
+            print("[DB] Updating assets table schema...")
+            # 新しいテーブルを作成
+            await db.execute('''
+                CREATE TABLE assets_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id TEXT NOT NULL,
+                    symbol TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    decimals INTEGER NOT NULL DEFAULT 2,
+                    UNIQUE(guild_id, symbol)
+                )
+            ''')
             
-            # created_atカラムが存在する場合は削除（新しいスキーマに合わせる）
-            if 'created_at' in column_names:
-                print("[DB] Updating assets table schema...")
-                # 新しいテーブルを作成
-                await db.execute('''
-                    CREATE TABLE assets_new (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        guild_id TEXT NOT NULL,
-                        symbol TEXT NOT NULL,
-                        name TEXT NOT NULL,
-                        decimals INTEGER NOT NULL DEFAULT 2,
-                        UNIQUE(guild_id, symbol)
-                    )
-                ''')
-                
-                # データを移行
-                await db.execute('''
-                    INSERT INTO assets_new (id, guild_id, symbol, name, decimals)
-                    SELECT id, guild_id, symbol, name, decimals FROM assets
-                ''')
-                
-                # 古いテーブルを削除し、新しいテーブルをリネーム
-                await db.execute('DROP TABLE assets')
-                await db.execute('ALTER TABLE assets_new RENAME TO assets')
-                print("[DB] Assets table schema updated successfully")
-        except:
-            # テーブルが存在しない場合は通常の作成処理
-            pass
-        
-        # accountsテーブルの情報を確認してtypeカラムの存在を確認
-        try:
-            cursor = await db.execute("PRAGMA table_info(accounts)")
-            columns = await cursor.fetchall()
-            column_names = [col[1] for col in columns]
+            # データを移行
+            await db.execute('''
+                INSERT INTO assets_new (id, guild_id, symbol, name, decimals)
+                SELECT id, guild_id, symbol, name, decimals FROM assets
+            ''')
             
-            # typeカラムが存在しない場合は新しいスキーマで再作成
-            if 'type' not in column_names:
-                print("[DB] Updating accounts table schema...")
-                # 新しいテーブルを作成
-                await db.execute('''
-                    CREATE TABLE accounts_new (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        guild_id TEXT NOT NULL,
-                        name TEXT NOT NULL,
-                        type TEXT NOT NULL CHECK (type IN ('user','treasury','burn')),
-                        is_active INTEGER NOT NULL DEFAULT 1,
-                        UNIQUE(guild_id, name),
-                        FOREIGN KEY (user_id) REFERENCES users(id)
-                    )
-                ''')
-                
-                # データを移行（typeを推定して設定）
-                await db.execute('''
-                    INSERT INTO accounts_new (id, user_id, guild_id, name, type, is_active)
-                    SELECT id, user_id, guild_id, name,
-                           CASE 
-                               WHEN name LIKE '%Treasury' THEN 'treasury'
-                               WHEN name LIKE '%Burn' THEN 'burn'
-                               ELSE 'user'
-                           END as type,
-                           1 as is_active
-                    FROM accounts
-                ''')
-                
-                # 古いテーブルを削除し、新しいテーブルをリネーム
-                await db.execute('DROP TABLE accounts')
-                await db.execute('ALTER TABLE accounts_new RENAME TO accounts')
-                print("[DB] Accounts table schema updated successfully")
-        except:
-            # テーブルが存在しない場合は通常の作成処理
-            pass
-        
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                discord_user_id TEXT NOT NULL UNIQUE
-            )
-        ''')
-        
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS assets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id TEXT NOT NULL,
-                symbol TEXT NOT NULL,
-                name TEXT NOT NULL,
-                decimals INTEGER NOT NULL DEFAULT 2,
-                UNIQUE(guild_id, symbol)
-            )
-        ''')
+            # 古いテーブルを削除し、新しいテーブルをリネーム
+            await db.execute('DROP TABLE assets')
+            await db.execute('ALTER TABLE assets_new RENAME TO assets')
+            print("[DB] Assets table schema updated successfully")
+    except:
+        # テーブルが存在しない場合は通常の作成処理
+        pass
+    
+    # accountsテーブルの情報を確認してtypeカラムの存在を確認
+    try:
+        cursor = await db.execute("PRAGMA table_info(accounts)")
+        columns = await cursor.fetchall()
+        column_names = [col[1] for col in columns]
         
+        # typeカラムが存在しない場合は新しいスキーマで再作成
+        if 'type' not in column_names:
+            print("[DB] Updating accounts table schema...")
+            # 新しいテーブルを作成
+            await db.execute('''
+                CREATE TABLE accounts_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    guild_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    type TEXT NOT NULL CHECK (type IN ('user','treasury','burn')),
+                    is_active INTEGER NOT NULL DEFAULT 1,
+                    UNIQUE(guild_id, name),
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )
+            ''')
+            
+            # データを移行（typeを推定して設定）
+            await db.execute('''
+                INSERT INTO accounts_new (id, user_id, guild_id, name, type, is_active)
+                SELECT id, user_id, guild_id, name,
+                       CASE 
+                           WHEN name LIKE '%Treasury' THEN 'treasury'
+                           WHEN name LIKE '%Burn' THEN 'burn'
+                           ELSE 'user'
+                       END as type,
+                       1 as is_active
+                FROM accounts
+            ''')
+            
+            # 古いテーブルを削除し、新しいテーブルをリネーム
+            await db.execute('DROP TABLE accounts')
+            await db.execute('ALTER TABLE accounts_new RENAME TO accounts')
+            print("[DB] Accounts table schema updated successfully")
+    except:
+        # テーブルが存在しない場合は通常の作成処理
+        pass
+    
+    # transactions.created_at に既定値（JSTの現在時刻）がない場合は再作成
+    cursor = await db.execute("PRAGMA table_info(transactions)")
+    columns = await cursor.fetchall()
+    created_at_defaults = [col[4] for col in columns if col[1] == 'created_at']
+    if created_at_defaults and created_at_defaults[0] is None:
+        print("[DB] Updating transactions table schema...")
+        # created_at の既定値は下の transactions 定義と同じ（日本標準時）
         await db.execute('''
-            CREATE TABLE IF NOT EXISTS accounts (
+            CREATE TABLE transactions_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
                 guild_id TEXT NOT NULL,
-                name TEXT NOT NULL,
-                type TEXT NOT NULL CHECK (type IN ('user','treasury','burn')),
-                is_active INTEGER NOT NULL DEFAULT 1,
-                UNIQUE(guild_id, name),
-                FOREIGN KEY (user_id) REFERENCES users(id)
+                description TEXT NOT NULL,
+                created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+09:00', 'now', '+9 hours'))
             )
         ''')
-        
         await db.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id TEXT NOT NULL,
-                description TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
+            INSERT INTO transactions_new (id, guild_id, description, created_at)
+            SELECT id, guild_id, description, created_at FROM transactions
         ''')
-        
+        await db.execute('DROP TABLE transactions')
+        await db.execute('ALTER TABLE transactions_new RENAME TO transactions')
+        print("[DB] Transactions table schema updated successfully")
+    
+    # ledger_entries.amount がTEXT（Decimal文字列）の場合は最小単位のINTEGERに移行
+    cursor = await db.execute("PRAGMA table_info(ledger_entries)")
+    columns = await cursor.fetchall()
+    amount_types = [col[2] for col in columns if col[1] == 'amount']
+    if amount_types and amount_types[0].upper() != 'INTEGER':
+        print("[DB] Migrating ledger amounts to integer units...")
         await db.execute('''
-            CREATE TABLE IF NOT EXISTS ledger_entries (
+            CREATE TABLE ledger_entries_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 transaction_id INTEGER NOT NULL,
                 account_id INTEGER NOT NULL,
                 asset_id INTEGER NOT NULL,
-                amount TEXT NOT NULL,
+                amount INTEGER NOT NULL,
                 FOREIGN KEY (transaction_id) REFERENCES transactions(id) ON DELETE CASCADE,
                 FOREIGN KEY (account_id) REFERENCES accounts(id),
                 FOREIGN KEY (asset_id) REFERENCES assets(id)
             )
         ''')
         
-        await db.commit()
+        # 通貨の小数桁数に合わせて変換（通貨が見つからない場合は既定桁数）
+        # 旧データは浮動小数点の誤差を含むため、切り捨てではなく最も近い単位に丸める
+        cursor = await db.execute('''
+            SELECT le.id, le.transaction_id, le.account_id, le.asset_id, le.amount, a.decimals, a.guild_id, a.symbol
+            FROM ledger_entries le
+            LEFT JOIN assets a ON le.asset_id = a.id
+        ''')
+        rows = await cursor.fetchall()
+        converted = []
+        overflow_assets = set()
+        for entry_id, transaction_id, account_id, asset_id, amount, decimals, guild_id, symbol in rows:
+            units = to_units(Decimal(str(amount)), DEFAULT_DECIMALS if decimals is None else decimals,
+                             rounding=ROUND_HALF_EVEN)
+            if abs(units) > MAX_UNITS:
+                overflow_assets.add(f"{symbol} (guild {guild_id}, decimals {decimals})")
+            converted.append((entry_id, transaction_id, account_id, asset_id, units))
+        
+        # 旧版は小数桁数を制限していなかったため、INTEGERに収まらない金額は移行を中止する
+        if overflow_assets:
+            raise RuntimeError(
+                "最小単位がINTEGERの上限を超える取引があるため、台帳を移行できません: "
+                + ", ".join(sorted(overflow_assets))
+                + "。該当通貨の小数桁数か金額を修正してから再起動してください。"
+            )
+        
+        await db.executemany('''
+            INSERT INTO ledger_entries_new (id, transaction_id, account_id, asset_id, amount)
+            VALUES (?, ?, ?, ?, ?)
+        ''', converted)
+        
+        # 古いテーブルを削除し、新しいテーブルをリネーム（残高キャッシュは再集計）
+        await db.execute('DROP TABLE ledger_entries')
+        await db.execute('ALTER TABLE ledger_entries_new RENAME TO ledger_entries')
+        await db.execute('DROP TABLE IF EXISTS account_balances')
+        print("[DB] Ledger amounts migrated successfully")
+    
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discord_user_id TEXT NOT NULL UNIQUE
+        )
+    ''')
+    
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS assets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            name TEXT NOT NULL,
+            decimals INTEGER NOT NULL DEFAULT 2,
+            UNIQUE(guild_id, symbol)
+        )
+    ''')
+    
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            guild_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL CHECK (type IN ('user','treasury','burn')),
+            is_active INTEGER NOT NULL DEFAULT 1,
+            UNIQUE(guild_id, name),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    
+    # created_at は日本標準時（JST、UTC+9）のISO 8601文字列をSQLite側で記録する
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id TEXT NOT NULL,
+            description TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+09:00', 'now', '+9 hours'))
+        )
+    ''')
+    
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            asset_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            FOREIGN KEY (transaction_id) REFERENCES transactions(id) ON DELETE CASCADE,
+            FOREIGN KEY (account_id) REFERENCES accounts(id),
+            FOREIGN KEY (asset_id) REFERENCES assets(id)
+        )
+    ''')
+    
+    # 検索用インデックス
+    # 台帳の集計は金額まで含めたインデックスだけで完結させる
+    await db.execute("DROP INDEX IF EXISTS idx_le_acc_asset")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_le_acc_asset_amount ON ledger_entries(account_id, asset_id, amount)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_le_asset_acc_amount ON ledger_entries(asset_id, account_id, amount)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_accounts_guild_type ON accounts(guild_id, type)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_assets_guild_symbol ON assets(guild_id, symbol, id, decimals, name)")
+    # 口座の検索は有効な口座のみが対象
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_active_accounts ON accounts(guild_id, name) WHERE is_active = 1")
+    
+    # 通貨シンボルの制約（英数字1-16文字）、既存データがあるためCHECKではなくトリガーで新規作成時に検証
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_assets_symbol BEFORE INSERT ON assets
+        WHEN length(NEW.symbol) NOT BETWEEN 1 AND 16 OR NEW.symbol GLOB '*[^A-Za-z0-9]*'
+        BEGIN
+            SELECT RAISE(ABORT, 'invalid currency symbol');
+        END
+    ''')
+    
+    # 残高キャッシュ（ledger_entriesへのINSERT/DELETEでトリガーにより更新）
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'account_balances'")
+    has_balances = await cursor.fetchone() is not None
+    
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS account_balances (
+            account_id INTEGER NOT NULL,
+            asset_id INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            PRIMARY KEY (account_id, asset_id)
+        )
+    ''')
+    # 通貨単位での残高確認（削除時など）用
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ab_asset ON account_balances(asset_id)")
+    
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_ins AFTER INSERT ON ledger_entries
+        BEGIN
+            INSERT INTO account_balances (account_id, asset_id, balance)
+            VALUES (NEW.account_id, NEW.asset_id, NEW.amount)
+            ON CONFLICT(account_id, asset_id) DO UPDATE
+            SET balance = balance + NEW.amount;
+        END
+    ''')
+    
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ledger_del AFTER DELETE ON ledger_entries
+        BEGIN
+            UPDATE account_balances
+            SET balance = balance - OLD.amount
+            WHERE account_id = OLD.account_id AND asset_id = OLD.asset_id;
+        END
+    ''')
+    
+    # 既存DBの場合は台帳から残高を再集計
+    if not has_balances:
+        await db.execute('''
+            INSERT INTO account_balances (account_id, asset_id, balance)
+            SELECT account_id, asset_id, SUM(amount)
+            FROM ledger_entries
+            GROUP BY account_id, asset_id
+        ''')
 
 async def fetch_one(db, query: str, params=()) -> Optional[Tuple]:
-    """単一レコードを取得"""
-    cursor = await db.execute(query, params)
-    return await cursor.fetchone()
+    """単一レコードを取得（1回の往復で実行と取得を行う）"""
+    rows = await db.execute_fetchall(query, params)
+    return rows[0] if rows else None
 
 async def fetch_all(db, query: str, params=()) -> List[Tuple]:
-    """全レコードを取得"""
-    cursor = await db.execute(query, params)
-    return await cursor.fetchall()
+    """全レコードを取得（1回の往復で実行と取得を行う）"""
+    return await db.execute_fetchall(query, params)
+
+# ========================== キャッシュ ==========================
+
+# 作成後に変化しない参照データのプロセス内キャッシュ
+CACHE_MAX_SIZE = 10000
+_asset_cache: Dict[Tuple[str, str], Tuple] = {}  # (guild_id, symbol) -> (id, symbol, name, decimals)
+_account_cache: Dict[Tuple[str, str], int] = {}  # (guild_id, アカウント名) -> account_id
+
+# ギルドの通貨一覧（オートコンプリートで頻繁に参照、/create・/deleteで破棄）
+GUILD_ASSETS_CACHE_TTL = 30  # 秒
+_guild_assets_cache: Dict[str, Tuple[float, List[Tuple]]] = {}  # guild_id -> (取得時刻, 通貨一覧)
+
+def _cache_put(cache: Dict, key: Any, value: Any):
+    """キャッシュに登録（未コミットの値は登録せず、上限を超えたら古いものから削除）"""
+    # 共有接続ではトランザクション中の書き込みが他タスクの読み取りにも見えるため、
+    # どのタスクがトランザクションを開いていてもキャッシュしない
+    if _in_transaction.get() or DB_LOCK.locked():
+        return
+    if len(cache) >= CACHE_MAX_SIZE:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+# ========================== SQL ==========================
+
+# 複数の関数から実行するSQL（文を一箇所にまとめて管理する）
+SQL_UPSERT_ACCOUNT = """
+    INSERT INTO accounts (user_id, guild_id, name, type) VALUES (?, ?, ?, ?)
+    ON CONFLICT(guild_id, name) DO UPDATE SET name = excluded.name
+    RETURNING id
+"""
+
+SQL_ACCOUNT_ID_BY_NAME = "SELECT id FROM accounts WHERE name = ? AND guild_id = ? AND is_active = 1 LIMIT 1"
+
+SQL_BALANCE_OF = """
+    SELECT balance FROM account_balances 
+    WHERE account_id = ? AND asset_id = ?
+"""
+
+SQL_ASSET_BY_SYMBOL = """
+    SELECT id, symbol, name, decimals 
+    FROM assets 
+    WHERE guild_id = ? AND symbol = ?
+    LIMIT 1
+"""
+
+SQL_TRANSFER_CONTEXT = """
+    SELECT 
+        a.id, 
+        a.symbol, 
+        a.name, 
+        a.decimals, 
+        f.id, 
+        t.id, 
+        COALESCE((SELECT balance FROM account_balances WHERE account_id = f.id AND asset_id = a.id), 0)
+    FROM assets a
+    LEFT JOIN accounts f ON f.guild_id = a.guild_id AND f.name = ? AND f.is_active = 1
+    LEFT JOIN accounts t ON t.guild_id = a.guild_id AND t.name = ? AND t.is_active = 1
+    WHERE a.guild_id = ? AND a.symbol = ?
+"""
+
+SQL_INSERT_TRANSACTION = """
+    INSERT INTO transactions (guild_id, description) 
+    VALUES (?, ?)
+    RETURNING id
+"""
+
+SQL_INSERT_LEDGER_ENTRY = """
+    INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
+    VALUES (?, ?, ?, ?)
+"""
+
+# オートコンプリート・一覧用のSQL
+SQL_GUILD_ASSETS = """
+    SELECT id, symbol, name, decimals 
+    FROM assets 
+    WHERE guild_id = ? 
+    ORDER BY symbol
+"""
+
+SQL_GUILD_ASSETS_WITH_BALANCE = """
+    SELECT 
+        a.id, 
+        a.symbol, 
+        a.name, 
+        a.decimals, 
+        COALESCE(ab.balance, 0)
+    FROM assets a
+    LEFT JOIN account_balances ab ON ab.asset_id = a.id AND ab.account_id = ?
+    WHERE a.guild_id = ?
+    ORDER BY a.symbol
+"""
+
+SQL_SEARCH_GUILD_ASSETS_WITH_BALANCE = """
+    SELECT 
+        a.id, 
+        a.symbol, 
+        a.name, 
+        a.decimals, 
+        COALESCE(ab.balance, 0)
+    FROM assets a
+    LEFT JOIN account_balances ab ON ab.asset_id = a.id AND ab.account_id = ?
+    WHERE a.guild_id = ?
+      AND (instr(py_lower(a.symbol), ?) > 0 OR instr(py_lower(a.name), ?) > 0)
+    ORDER BY a.symbol
+    LIMIT ?
+"""
 
 # ========================== ユーザー・アカウント管理 ==========================
 
-async def upsert_user(db, discord_user_id: int) -> int:
-    """ユーザーをDBに登録し、IDを返す"""
-    existing = await fetch_one(db, "SELECT id FROM users WHERE discord_user_id = ?", (str(discord_user_id),))
-    if existing:
-        return existing[0]
-    
-    cursor = await db.execute("INSERT INTO users (discord_user_id) VALUES (?)", (str(discord_user_id),))
-    return cursor.lastrowid
+async def upsert_account(db, user_id: Optional[int], guild_id: str, name: str, account_type: str) -> int:
+    """口座をDBに登録し、IDを返す"""
+    row = await fetch_one(db, SQL_UPSERT_ACCOUNT, (user_id, guild_id, name, account_type))
+    return row[0]
+
+async def ensure_user_accounts(db, guild_id: str, discord_user_ids: List[int]) -> None:
+    """複数ユーザーの口座をまとめて確保"""
+    user_ids = [str(discord_user_id) for discord_user_id in discord_user_ids]
+    async with transaction(db):
+        await db.executemany(
+            "INSERT INTO users (discord_user_id) VALUES (?) ON CONFLICT(discord_user_id) DO NOTHING",
+            [(user_id,) for user_id in user_ids]
+        )
+        await db.executemany("""
+            INSERT INTO accounts (user_id, guild_id, name, type)
+            SELECT id, ?, ?, 'user' FROM users WHERE discord_user_id = ?
+            ON CONFLICT(guild_id, name) DO NOTHING
+        """, [(guild_id, f"user:{user_id}", user_id) for user_id in user_ids])
 
-async def ensure_user_account(db, discord_user_id: int, guild_id: int) -> int:
-    """ユーザーアカウント（口座）を確保し、IDを返す"""
-    user_id = await upsert_user(db, discord_user_id)
-    account_name = f"user:{discord_user_id}"
+async def account_id_by_name(db, name: str, guild_id: str) -> int:
+    """アカウント名からIDを取得"""
+    key = (guild_id, name)
+    if key in _account_cache:
+        return _account_cache[key]
     
-    existing = await fetch_one(db, "SELECT id FROM accounts WHERE name = ? AND guild_id = ?", (account_name, str(guild_id)))
-    if existing:
-        return existing[0]
+    result = await fetch_one(db, SQL_ACCOUNT_ID_BY_NAME, (name, guild_id))
+    if not result:
+        return None
     
-    cursor = await db.execute("INSERT INTO accounts (user_id, guild_id, name, type) VALUES (?, ?, ?, ?)", (user_id, str(guild_id), account_name, 'user'))
-    return cursor.lastrowid
+    _cache_put(_account_cache, key, result[0])
+    return result[0]
 
-async def account_id_by_name(db, name: str, guild_id: int) -> int:
-    """アカウント名からIDを取得"""
-    result = await fetch_one(db, "SELECT id FROM accounts WHERE name = ? AND guild_id = ?", (name, str(guild_id)))
-    return result[0] if result else None
-
-async def balance_of(db, account_id: int, asset_id: int) -> Decimal:
-    """残高を取得"""
-    result = await fetch_one(db, """
-        SELECT SUM(CAST(amount AS DECIMAL)) FROM ledger_entries 
-        WHERE account_id = ? AND asset_id = ?
-    """, (account_id, asset_id))
-    return Decimal(result[0] or '0')
+async def balance_of(db, account_id: int, asset_id: int) -> int:
+    """残高を取得（最小単位の整数）"""
+    result = await fetch_one(db, SQL_BALANCE_OF, (account_id, asset_id))
+    return result[0] if result else 0
 
 # ========================== 通貨管理 ==========================
 
-async def create_asset(db, guild_id: int, symbol: str, name: str, decimals: int = DEFAULT_DECIMALS, initial_supply: Decimal = Decimal('0')) -> Tuple[bool, str, Optional[int]]:
+async def create_asset(db, guild_id: str, symbol: str, name: str, decimals: int = DEFAULT_DECIMALS, initial_supply: Decimal = Decimal('0')) -> Tuple[bool, str, Optional[int]]:
     """
     新しい通貨を作成
     返り値: (成功フラグ, メッセージ, asset_id)
     """
     try:
-        # 重複チェック
-        existing = await fetch_one(db, "SELECT id FROM assets WHERE guild_id = ? AND symbol = ?", (str(guild_id), symbol))
-        if existing:
-            return False, f"シンボル '{symbol}' は既に存在します。", None
-        
-        # 通貨作成
-        cursor = await db.execute("""
-            INSERT INTO assets (guild_id, symbol, name, decimals) 
-            VALUES (?, ?, ?, ?)
-        """, (str(guild_id), symbol, name, decimals))
-        
-        asset_id = cursor.lastrowid
-        
-        # Treasuryアカウントを確保
-        treasury_account = await ensure_treasury_account(db, guild_id)
-        
-        # 初期供給量があれば直接Treasuryに追加（発行）
-        if initial_supply > 0:
-            # トランザクション作成
+        async with transaction(db):
+            # 重複チェック
+            existing = await fetch_one(db, "SELECT 1 FROM assets WHERE guild_id = ? AND symbol = ? LIMIT 1", (guild_id, symbol))
+            if existing:
+                return False, f"シンボル '{symbol}' は既に存在します。", None
+            
+            # 通貨作成
             cursor = await db.execute("""
-                INSERT INTO transactions (guild_id, description, created_at) 
-                VALUES (?, ?, ?)
-            """, (str(guild_id), f"初期供給: {symbol}", datetime.now(TZ).isoformat()))
+                INSERT INTO assets (guild_id, symbol, name, decimals) 
+                VALUES (?, ?, ?, ?)
+            """, (guild_id, symbol, name, decimals))
             
-            transaction_id = cursor.lastrowid
+            asset_id = cursor.lastrowid
             
-            # Treasuryに初期供給量を追加（正の値で記録）
-            await db.execute("""
-                INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
-                VALUES (?, ?, ?, ?)
-            """, (transaction_id, treasury_account, asset_id, str(initial_supply)))
+            # Treasuryアカウントを確保
+            treasury_account = await ensure_treasury_account(db, guild_id)
+            
+            # 初期供給量があれば直接Treasuryに追加（発行）
+            if initial_supply > 0:
+                # トランザクション作成
+                transaction_id = (await fetch_one(db, SQL_INSERT_TRANSACTION, (guild_id, f"初期供給: {symbol}")))[0]
+                
+                # Treasuryに初期供給量を追加（正の値で記録）
+                await db.execute(SQL_INSERT_LEDGER_ENTRY, (transaction_id, treasury_account, asset_id, to_units(initial_supply, decimals)))
         
-        await db.commit()
+        _guild_assets_cache.pop(guild_id, None)
         return True, f"通貨 '{symbol}' ({name}) を作成しました。", asset_id
         
     except Exception as e:
-        await db.rollback()
         return False, f"通貨作成エラー: {str(e)}", None
 
-async def ensure_treasury_account(db, guild_id: int) -> int:
+async def ensure_treasury_account(db, guild_id: str) -> int:
     """Treasuryアカウントを確保"""
     treasury_name = "treasury"
-    existing = await fetch_one(db, "SELECT id FROM accounts WHERE name = ? AND guild_id = ?", (treasury_name, str(guild_id)))
-    if existing:
-        return existing[0]
+    cached = _account_cache.get((guild_id, treasury_name))
+    if cached is not None:
+        return cached
+    
+    async with transaction(db):
+        account_id = await upsert_account(db, None, guild_id, treasury_name, 'treasury')
     
-    cursor = await db.execute("INSERT INTO accounts (user_id, guild_id, name, type) VALUES (?, ?, ?, ?)", (None, str(guild_id), treasury_name, 'treasury'))
-    return cursor.lastrowid
+    _cache_put(_account_cache, (guild_id, treasury_name), account_id)
+    return account_id
 
-async def ensure_burn_account(db, guild_id: int) -> int:
+async def ensure_burn_account(db, guild_id: str) -> int:
     """Burnアカウントを確保"""
     burn_name = "burn"
-    existing = await fetch_one(db, "SELECT id FROM accounts WHERE name = ? AND guild_id = ?", (burn_name, str(guild_id)))
-    if existing:
-        return existing[0]
+    cached = _account_cache.get((guild_id, burn_name))
+    if cached is not None:
+        return cached
     
-    cursor = await db.execute("INSERT INTO accounts (user_id, guild_id, name, type) VALUES (?, ?, ?, ?)", (None, str(guild_id), burn_name, 'burn'))
-    return cursor.lastrowid
+    async with transaction(db):
+        account_id = await upsert_account(db, None, guild_id, burn_name, 'burn')
+    
+    _cache_put(_account_cache, (guild_id, burn_name), account_id)
+    return account_id
 
-async def issue_currency(db, guild_id: int, from_account: int, to_account: int, asset_id: int, amount: Decimal, description: str) -> bool:
-    """通貨発行（二重仕訳）"""
-    try:
-        # トランザクション作成
-        cursor = await db.execute("""
-            INSERT INTO transactions (guild_id, description, created_at) 
-            VALUES (?, ?, ?)
-        """, (str(guild_id), description, datetime.now(TZ).isoformat()))
-        
-        transaction_id = cursor.lastrowid
-        
-        # 発行元（Treasury）から減額（負の値で記録）
-        await db.execute("""
-            INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
-            VALUES (?, ?, ?, ?)
-        """, (transaction_id, from_account, asset_id, str(-amount)))
-        
-        # 受取先（ユーザー）に増額（正の値で記録）
-        await db.execute("""
-            INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
-            VALUES (?, ?, ?, ?)
-        """, (transaction_id, to_account, asset_id, str(amount)))
+async def register_guild(db, guild_id: str):
+    """ギルドのTreasury・Burnアカウントを事前に作成（コマンド実行時の作成を省く）"""
+    await ensure_treasury_account(db, guild_id)
+    await ensure_burn_account(db, guild_id)
+
+async def _record_moves(db, guild_id: str, asset_id: int, moves: List[Tuple[int, int, int]], description: str) -> int:
+    """
+    1つの取引に複数の移動（送金元, 送金先, 最小単位の金額）を二重仕訳で記録し、取引IDを返す
+    金額・口座が不正な場合や送金元の残高が不足する場合は ValueError
+    """
+    # 送金元ごとの出金合計
+    debits = {}
+    for from_account, to_account, amount in moves:
+        if not 0 < amount <= MAX_UNITS:
+            raise ValueError("金額が不正です。")
+        if from_account == to_account:
+            raise ValueError("送金元と送金先が同じです。")
+        debits[from_account] = debits.get(from_account, 0) + amount
+    
+    async with transaction(db):
+        # 残高は書き込みと同じトランザクション内で確認し、並行した送金による残高超過を防ぐ
+        placeholders = ", ".join("?" * len(debits))
+        balances = dict(await fetch_all(db, f"""
+            SELECT account_id, balance FROM account_balances
+            WHERE asset_id = ? AND account_id IN ({placeholders})
+        """, (asset_id, *debits)))
+        if any(balances.get(account, 0) < total for account, total in debits.items()):
+            raise ValueError("残高が不足しています。")
         
-        return True
+        # トランザクション作成
+        transaction_id = (await fetch_one(db, SQL_INSERT_TRANSACTION, (guild_id, description)))[0]
         
-    except Exception as e:
-        await db.rollback()
-        print(f"通貨発行エラー: {e}")
-        return False
+        # 送金元から減額（負の値）、送金先に加算（正の値）
+        entries = []
+        for from_account, to_account, amount in moves:
+            entries.append((transaction_id, from_account, asset_id, -amount))
+            entries.append((transaction_id, to_account, asset_id, amount))
+        await db.executemany(SQL_INSERT_LEDGER_ENTRY, entries)
+    
+    return transaction_id
 
-async def transfer_currency(db, guild_id: int, from_account: int, to_account: int, asset_id: int, amount: Decimal, description: str) -> bool:
-    """通貨送金（二重仕訳）"""
+async def transfer_currency(db, guild_id: str, asset_id: int, moves: List[Tuple[int, int, int]], description: str) -> Tuple[bool, str]:
+    """
+    通貨送金（二重仕訳、複数の送金は1つの取引にまとめて記録）
+    moves: [(送金元account_id, 送金先account_id, 最小単位の金額), ...]
+    返り値: (成功フラグ, 失敗時のメッセージ)
+    """
+    if not moves:
+        return True, ""
+    
     try:
-        # トランザクション作成
-        cursor = await db.execute("""
-            INSERT INTO transactions (guild_id, description, created_at) 
-            VALUES (?, ?, ?)
-        """, (str(guild_id), description, datetime.now(TZ).isoformat()))
-        
-        transaction_id = cursor.lastrowid
-        
-        # 送金者から減額
-        await db.execute("""
-            INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
-            VALUES (?, ?, ?, ?)
-        """, (transaction_id, from_account, asset_id, str(-amount)))
-        
-        # 受取者に加算
-        await db.execute("""
-            INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
-            VALUES (?, ?, ?, ?)
-        """, (transaction_id, to_account, asset_id, str(amount)))
-        
-        return True
+        await _record_moves(db, guild_id, asset_id, moves, description)
+        return True, ""
         
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
-        await db.rollback()
-        return False
+        print(f"送金エラー: {e}")
+        return False, "送金処理中にエラーが発生しました。"
 
 # ========================== 通貨情報取得 ==========================
 
-async def get_asset_by_symbol(db, guild_id: int, symbol: str) -> Optional[Tuple]:
+async def get_asset_by_symbol(db, guild_id: str, symbol: str) -> Optional[Tuple]:
     """シンボルから通貨情報を取得"""
-    return await fetch_one(db, """
-        SELECT id, symbol, name, decimals 
-        FROM assets 
-        WHERE guild_id = ? AND symbol = ?
-    """, (str(guild_id), symbol))
-
-async def get_user_balances(db, user_account_id: int, guild_id: int) -> List[Tuple]:
-    """ユーザーの全残高を取得"""
+    key = (guild_id, symbol)
+    if key in _asset_cache:
+        return _asset_cache[key]
+    
+    asset = await fetch_one(db, SQL_ASSET_BY_SYMBOL, (guild_id, symbol))
+    if asset:
+        _cache_put(_asset_cache, key, asset)
+    return asset
+
+async def get_transfer_context(db, guild_id: str, symbol: str, from_name: str, to_name: str) -> Optional[Tuple]:
+    """
+    送金に必要な情報を1クエリで取得
+    返り値: (asset_id, symbol, name, decimals, 送金元account_id, 送金先account_id, 送金元残高)
+    口座が存在しない場合、そのaccount_idはNone
+    """
+    context = await fetch_one(db, SQL_TRANSFER_CONTEXT, (from_name, to_name, guild_id, symbol))
+    if context:
+        # 解決できた口座IDは以降の ensure_*_account / account_id_by_name で使い回す
+        if context[4] is not None:
+            _cache_put(_account_cache, (guild_id, from_name), context[4])
+        if context[5] is not None:
+            _cache_put(_account_cache, (guild_id, to_name), context[5])
+    return context
+
+async def get_user_balances(db, user_account_id: int) -> List[Tuple]:
+    """ユーザーの全残高を取得（口座はギルドごとなので、ギルドでの絞り込みは不要）"""
     return await fetch_all(db, """
         SELECT 
             a.symbol, 
             a.name, 
-            SUM(CAST(le.amount AS DECIMAL)) as balance, 
+            ab.balance, 
             a.decimals
-        FROM ledger_entries le
-        JOIN assets a ON le.asset_id = a.id
-        WHERE le.account_id = ? AND a.guild_id = ?
-        GROUP BY a.id, a.symbol, a.name, a.decimals
-        HAVING SUM(CAST(le.amount AS DECIMAL)) > 0
+        FROM account_balances ab
+        JOIN assets a ON ab.asset_id = a.id
+        WHERE ab.account_id = ? AND ab.balance > 0
         ORDER BY a.symbol
-    """, (user_account_id, str(guild_id)))
+    """, (user_account_id,))
 
-async def get_treasury_balances(db, guild_id: int) -> List[Tuple]:
-    """Treasury残高を取得"""
+async def get_treasury_balances(db, guild_id: str) -> List[Tuple]:
+    """Treasury残高を取得（ギルドの全通貨、残高がない通貨は0）"""
     treasury_account = await account_id_by_name(db, "treasury", guild_id)
     if not treasury_account:
         return []
     
-    return await fetch_all(db, """
-        SELECT 
-            a.symbol, 
-            a.name, 
-            SUM(CAST(le.amount AS DECIMAL)) as balance, 
-            a.decimals
-        FROM ledger_entries le
-        JOIN assets a ON le.asset_id = a.id
-        WHERE le.account_id = ? AND a.guild_id = ?
-        GROUP BY a.id, a.symbol, a.name, a.decimals
-        ORDER BY a.symbol
-    """, (treasury_account, str(guild_id)))
+    assets = await get_guild_assets_with_user_balance(db, guild_id, treasury_account)
+    return [(symbol, name, balance, decimals) for asset_id, symbol, name, decimals, balance in assets]
 
-async def get_guild_assets(db, guild_id: int) -> List[Tuple]:
+async def get_guild_assets(db, guild_id: str) -> List[Tuple]:
     """ギルドの全通貨を取得"""
-    return await fetch_all(db, """
-        SELECT id, symbol, name, decimals 
-        FROM assets 
-        WHERE guild_id = ? 
-        ORDER BY symbol
-    """, (str(guild_id),))
+    cached = _guild_assets_cache.get(guild_id)
+    if cached and time.monotonic() - cached[0] < GUILD_ASSETS_CACHE_TTL:
+        return cached[1]
+    
+    assets = await fetch_all(db, SQL_GUILD_ASSETS, (guild_id,))
+    _cache_put(_guild_assets_cache, guild_id, (time.monotonic(), assets))
+    return assets
+
+async def get_guild_assets_with_user_balance(db, guild_id: str, user_account_id: int) -> List[Tuple]:
+    """ギルドの全通貨と口座の残高を1クエリで取得（残高がない通貨は0）"""
+    return await fetch_all(db, SQL_GUILD_ASSETS_WITH_BALANCE, (user_account_id, guild_id))
+
+async def search_guild_assets_with_user_balance(db, guild_id: str, user_account_id: int, current: str, limit: int = 25) -> List[Tuple]:
+    """シンボルか名前に文字列を含む通貨と口座の残高を取得（オートコンプリート用）"""
+    needle = current.lower()
+    return await fetch_all(db, SQL_SEARCH_GUILD_ASSETS_WITH_BALANCE, (user_account_id, guild_id, needle, needle, limit))
 
 # ========================== Embed作成関数 ==========================
 
+def _build_embed(title: str, description: Optional[str], color: int, user: discord.User = None, fields: List[Dict[str, Any]] = None) -> discord.Embed:
+    """辞書からEmbedを作成"""
+    data: Dict[str, Any] = {"title": title, "color": color}
+    if description is not None:
+        data["description"] = description
+    if fields:
+        data["fields"] = fields
+    if user:
+        data["footer"] = {"text": f"実行者: {user.display_name}", "icon_url": user.display_avatar.url}
+    return discord.Embed.from_dict(data)
+
 def create_success_embed(title: str, description: str, user: discord.User = None) -> discord.Embed:
     """成功Embedを作成"""
-    embed = discord.Embed(title=title, description=description, color=0x00ff00)
-    if user:
-        embed.set_footer(text=f"実行者: {user.display_name}", icon_url=user.display_avatar.url)
-    return embed
+    return _build_embed(title, description, 0x00ff00, user)
 
 def create_error_embed(title: str, description: str, user: discord.User = None) -> discord.Embed:
     """エラーEmbedを作成"""
-    embed = discord.Embed(title=title, description=description, color=0xff0000)
-    if user:
-        embed.set_footer(text=f"実行者: {user.display_name}", icon_url=user.display_avatar.url)
-    return embed
+    return _build_embed(title, description, 0xff0000, user)
 
 def create_info_embed(title: str, description: str, user: discord.User = None) -> discord.Embed:
     """情報Embedを作成"""
-    embed = discord.Embed(title=title, description=description, color=0x0099ff)
-    if user:
-        embed.set_footer(text=f"実行者: {user.display_name}", icon_url=user.display_avatar.url)
-    return embed
+    return _build_embed(title, description, 0x0099ff, user)
 
 def create_transaction_embed(transaction_type: str, from_user: str, to_user: str, amount: str, symbol: str, memo: str = None, executor: discord.User = None) -> discord.Embed:
     """取引Embedを作成"""
     title = f"💸 {transaction_type}"
     
-    embed = discord.Embed(title=title, color=0x00ff88)
-    embed.add_field(name="送金者", value=from_user, inline=True)
-    embed.add_field(name="受取者", value=to_user, inline=True)
-    embed.add_field(name="金額", value=f"**{amount} {symbol}**", inline=True)
+    fields = [
+        {"name": "送金者", "value": from_user, "inline": True},
+        {"name": "受取者", "value": to_user, "inline": True},
+        {"name": "金額", "value": f"**{amount} {symbol}**", "inline": True},
+    ]
     
     if memo:
-        embed.add_field(name="メモ", value=f"```{memo}```", inline=False)
+        fields.append({"name": "メモ", "value": f"```{memo}```", "inline": False})
+    
+    return _build_embed(title, None, 0x00ff88, executor, fields)
+
+def _build_help_embed() -> discord.Embed:
+    """ヘルプEmbedの固定部分を作成"""
+    embed = create_info_embed(
+        "🏦 VirtualCrypto Bot ヘルプ",
+        "サーバー内独自通貨システムの使い方"
+    )
     
+    # 一般ユーザー向けコマンド
+    embed.add_field(
+        name="👤 一般ユーザー向けコマンド",
+        value="**`/pay to:@ユーザー symbol:通貨 amount:金額 [memo:メモ]`**\n"
+              "他のユーザーに通貨を送金します\n\n"
+              "**`/bal [symbol:通貨]`**\n"
+              "自分の残高を確認します（プライベート表示）\n"
+              "• symbol省略時：全通貨の残高\n"
+              "• symbol指定時：特定通貨のみ",
+        inline=False
+    )
     
-    if executor:
-        embed.set_footer(text=f"実行者: {executor.display_name}", icon_url=executor.display_avatar.url)
+    # 管理者専用コマンド
+    embed.add_field(
+        name="🛡️ 管理者専用コマンド",
+        value="**`/create symbol:通貨 name:通貨名 [decimals:小数桁] [initial_supply:初期供給量]`**\n"
+              "新しい通貨を作成します\n\n"
+              "**`/give user:@ユーザー symbol:通貨 amount:金額 [memo:理由]`**\n"
+              "Treasuryから通貨を発行します\n\n"
+              "**`/treasury [symbol:通貨] [hidden:非公開]`**\n"
+              "Treasury残高を確認します\n\n"
+              "**`/delete symbol:通貨`**\n"
+              "通貨を削除します（全残高がゼロの場合のみ）",
+        inline=False
+    )
+    
+    # システムの特徴
+    embed.add_field(
+        name="💡 システムの特徴",
+        value="• **二重仕訳**: 正確な台帳管理で残高を保証\n"
+              "• **サーバー独立**: 各サーバーで完全に独立した通貨システム\n"
+              "• **オートコンプリート**: コマンド入力時に利用可能な通貨を表示\n"
+              "• **権限管理**: 管理者コマンドは「サーバー管理」権限が必要\n"
+              "• **透明性**: 送金は公開、残高確認は個人のみ表示",
+        inline=False
+    )
+    
+    # 使い方の例
+    embed.add_field(
+        name="📚 使い方の例",
+        value="1. 管理者が `/create symbol:GOLD name:ゴールドコイン decimals:2 initial_supply:10000` で通貨作成\n"
+              "2. 管理者が `/give user:@ユーザー symbol:GOLD amount:100` でユーザーに配布\n"
+              "3. ユーザーが `/pay to:@友達 symbol:GOLD amount:50 memo:ありがとう` で送金\n"
+              "4. ユーザーが `/bal` で自分の残高確認\n"
+              "5. 管理者が `/treasury symbol:GOLD` でTreasury残高確認",
+        inline=False
+    )
     
     return embed
 
+# ヘルプの内容は固定なので起動時に一度だけ作成し、フッターのみ実行時に設定
+HELP_EMBED_TEMPLATE = _build_help_embed()
+
 # ========================== ユーティリティ関数 ==========================
 
-def format_currency_amount(amount: Decimal, decimals: int) -> str:
-    """通貨金額をフォーマット"""
+def format_units(units: int, decimals: int) -> str:
+    """最小単位の整数を通貨金額の文字列にフォーマット（末尾の0は省略）"""
     if decimals == 0:
-        return str(int(amount))
-    else:
-        # 指定桁数で四捨五入
-        quantized = amount.quantize(Decimal('0.1') ** decimals, rounding=ROUND_DOWN)
-        return f"{quantized:.{decimals}f}".rstrip('0').rstrip('.')
+        return str(units)
+    sign = "-" if units < 0 else ""
+    whole, frac = divmod(abs(units), 10 ** decimals)
+    if frac == 0:
+        return f"{sign}{whole}"
+    return f"{sign}{whole}.{frac:0{decimals}d}".rstrip('0')
+
+def to_units(amount: Decimal, decimals: int, rounding: str = ROUND_DOWN) -> int:
+    """金額を最小単位の整数に変換（端数は既定で切り捨て）"""
+    return int(amount.scaleb(decimals).to_integral_value(rounding=rounding))
 
 def is_valid_currency_symbol(symbol: str) -> bool:
-    """通貨シンボルの有効性をチェック"""
-    return symbol.isalnum() and 1 <= len(symbol) <= 16
+    """通貨シンボルの有効性をチェック（DBのtrg_assets_symbolと同じ条件、エラーメッセージ表示用）"""
+    return symbol.isascii() and symbol.isalnum() and 1 <= len(symbol) <= 16
 
 def is_guild_manager(interaction: discord.Interaction) -> bool:
     """管理者権限のチェック"""
@@ -497,6 +909,10 @@ class VirtualCryptoCommands:
             embed = create_error_embed("入力エラー", "シンボルは英数字1-16文字で入力してください。", interaction.user)
             return await interaction.response.send_message(embed=embed, ephemeral=True)
         
+        if not 0 <= decimals <= MAX_DECIMALS:
+            embed = create_error_embed("入力エラー", f"小数桁数は0-{MAX_DECIMALS}で入力してください。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
         try:
             initial_supply_decimal = Decimal(str(initial_supply))
             if initial_supply_decimal < 0:
@@ -505,24 +921,28 @@ class VirtualCryptoCommands:
             embed = create_error_embed("入力エラー", "初期供給量が不正です。正の数値を入力してください。", interaction.user)
             return await interaction.response.send_message(embed=embed, ephemeral=True)
         
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
-            success, message, asset_id = await create_asset(
-                db, interaction.guild.id, symbol, name, decimals, initial_supply_decimal
+        if to_units(initial_supply_decimal, decimals) > MAX_UNITS:
+            embed = create_error_embed("入力エラー", "初期供給量が大きすぎます。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        db = DB
+        gid = str(interaction.guild.id)
+        success, message, asset_id = await create_asset(
+            db, gid, symbol, name, decimals, initial_supply_decimal
+        )
+        
+        if success:
+            embed = create_success_embed(
+                "通貨作成完了",
+                f"🪙 **{symbol}** ({name}) を作成しました！\n\n"
+                f"• 小数桁数: {decimals}桁\n"
+                f"• 初期供給量: {format_units(to_units(initial_supply_decimal, decimals), decimals)} {symbol}",
+                interaction.user
             )
-            
-            if success:
-                embed = create_success_embed(
-                    "通貨作成完了",
-                    f"🪙 **{symbol}** ({name}) を作成しました！\n\n"
-                    f"• 小数桁数: {decimals}桁\n"
-                    f"• 初期供給量: {format_currency_amount(initial_supply_decimal, decimals)} {symbol}",
-                    interaction.user
-                )
-            else:
-                embed = create_error_embed("作成エラー", message, interaction.user)
-            
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+        else:
+            embed = create_error_embed("作成エラー", message, interaction.user)
+        
+        await interaction.response.send_message(embed=embed, ephemeral=True)
     
     @staticmethod 
     async def pay_currency_command(interaction: discord.Interaction, to_user: discord.Member, symbol: str, amount: float, memo: str = None):
@@ -543,113 +963,114 @@ class VirtualCryptoCommands:
             embed = create_error_embed("入力エラー", "金額は正の数値を入力してください。", interaction.user)
             return await interaction.response.send_message(embed=embed, ephemeral=True)
         
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
+        db = DB
+        gid = str(interaction.guild.id)
+        # 通貨情報・口座・送金者残高を一括取得（口座が未作成の場合のみ作成して再取得）
+        from_name, to_name = f"user:{interaction.user.id}", f"user:{to_user.id}"
+        context = await get_transfer_context(db, gid, symbol, from_name, to_name)
+        if context and (context[4] is None or context[5] is None):
+            await ensure_user_accounts(db, gid, [interaction.user.id, to_user.id])
+            context = await get_transfer_context(db, gid, symbol, from_name, to_name)
+        
+        if not context:
+            embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        asset_id, symbol, asset_name, decimals, from_account, to_account, balance = context
+        
+        # 小数桁数調整
+        amount_units = to_units(amount_decimal, decimals)
+        if amount_units > MAX_UNITS:
+            embed = create_error_embed("入力エラー", "金額が大きすぎます。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        # 残高チェック
+        if balance < amount_units:
+            embed = create_error_embed(
+                "残高不足",
+                f"送金に必要な残高が不足しています。\n\n"
+                f"• 必要金額: {format_units(amount_units, decimals)} {symbol}\n"
+                f"• 現在残高: {format_units(balance, decimals)} {symbol}",
+                interaction.user
+            )
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        # 送金実行
+        description = f"送金: {interaction.user.display_name} → {to_user.display_name}"
+        if memo:
+            description += f" ({memo})"
+        
+        success, message = await transfer_currency(db, gid, asset_id, [(from_account, to_account, amount_units)], description)
+        
+        if success:
+            # 成功Embed
+            embed = create_transaction_embed(
+                "送金完了",
+                interaction.user.mention,
+                to_user.mention,
+                format_units(amount_units, decimals),
+                symbol,
+                memo,
+                interaction.user
+            )
             
-            # 通貨情報取得
-            asset = await get_asset_by_symbol(db, interaction.guild.id, symbol)
+            await interaction.response.send_message(embed=embed, ephemeral=False)
+        else:
+            embed = create_error_embed("送金エラー", message, interaction.user)
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+    
+    @staticmethod
+    async def balance_command(interaction: discord.Interaction, symbol: str = None):
+        """残高確認コマンドの処理（自分の残高のみ）"""
+        if not interaction.guild:
+            embed = create_error_embed("実行エラー", "このコマンドはサーバー内でのみ使用できます。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        db = DB
+        gid = str(interaction.guild.id)
+        if symbol:
+            # 特定通貨の残高（通貨情報と口座は独立しているので並行して取得、照会だけなので口座は作成しない）
+            asset, user_account = await asyncio.gather(
+                get_asset_by_symbol(db, gid, symbol),
+                account_id_by_name(db, f"user:{interaction.user.id}", gid),
+            )
             if not asset:
                 embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
                 return await interaction.response.send_message(embed=embed, ephemeral=True)
             
             asset_id, symbol, asset_name, decimals = asset
+            balance = await balance_of(db, user_account, asset_id) if user_account else 0
             
-            # 小数桁数調整
-            amount_decimal = amount_decimal.quantize(Decimal('0.1') ** decimals, rounding=ROUND_DOWN)
-            
-            # アカウント取得
-            from_account = await ensure_user_account(db, interaction.user.id, interaction.guild.id)
-            to_account = await ensure_user_account(db, to_user.id, interaction.guild.id)
-            
-            # 残高チェック
-            balance = await balance_of(db, from_account, asset_id)
-            if balance < amount_decimal:
-                embed = create_error_embed(
-                    "残高不足",
-                    f"送金に必要な残高が不足しています。\n\n"
-                    f"• 必要金額: {format_currency_amount(amount_decimal, decimals)} {symbol}\n"
-                    f"• 現在残高: {format_currency_amount(balance, decimals)} {symbol}",
-                    interaction.user
-                )
-                return await interaction.response.send_message(embed=embed, ephemeral=True)
-            
-            # 送金実行
-            description = f"送金: {interaction.user.display_name} → {to_user.display_name}"
-            if memo:
-                description += f" ({memo})"
-            
-            success = await transfer_currency(db, interaction.guild.id, from_account, to_account, asset_id, amount_decimal, description)
+            embed = create_info_embed(
+                "残高照会",
+                f"💰 あなたの {symbol} 残高\n\n"
+                f"**{format_units(balance, decimals)} {symbol}**",
+                interaction.user
+            )
+        else:
+            # 全通貨残高（口座がなければ保有通貨なし）
+            user_account = await account_id_by_name(db, f"user:{interaction.user.id}", gid)
+            balances = await get_user_balances(db, user_account) if user_account else []
             
-            if success:
-                await db.commit()
-                
-                # 成功Embed
-                embed = create_transaction_embed(
-                    "送金完了",
-                    interaction.user.mention,
-                    to_user.mention,
-                    format_currency_amount(amount_decimal, decimals),
-                    symbol,
-                    memo,
+            if not balances:
+                embed = create_info_embed(
+                    "残高照会", 
+                    f"💰 あなたの残高\n\n現在保有している通貨はありません。", 
                     interaction.user
                 )
-                
-                await interaction.response.send_message(embed=embed, ephemeral=False)
             else:
-                embed = create_error_embed("送金エラー", "送金処理中にエラーが発生しました。", interaction.user)
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-    
-    @staticmethod
-    async def balance_command(interaction: discord.Interaction, symbol: str = None):
-        """残高確認コマンドの処理（自分の残高のみ）"""
-        if not interaction.guild:
-            embed = create_error_embed("実行エラー", "このコマンドはサーバー内でのみ使用できます。", interaction.user)
-            return await interaction.response.send_message(embed=embed, ephemeral=True)
-        
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
-            
-            if symbol:
-                # 特定通貨の残高
-                asset = await get_asset_by_symbol(db, interaction.guild.id, symbol)
-                if not asset:
-                    embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
-                    return await interaction.response.send_message(embed=embed, ephemeral=True)
-                
-                asset_id, symbol, asset_name, decimals = asset
-                user_account = await ensure_user_account(db, interaction.user.id, interaction.guild.id)
-                balance = await balance_of(db, user_account, asset_id)
+                balance_text = "".join(
+                    f"• **{format_units(balance, decimals)} {symbol}** ({name})\n"
+                    for symbol, name, balance, decimals in balances
+                )
                 
                 embed = create_info_embed(
                     "残高照会",
-                    f"💰 あなたの {symbol} 残高\n\n"
-                    f"**{format_currency_amount(balance, decimals)} {symbol}**",
+                    f"💰 あなたの残高\n\n{balance_text}",
                     interaction.user
                 )
-            else:
-                # 全通貨残高
-                user_account = await ensure_user_account(db, interaction.user.id, interaction.guild.id)
-                balances = await get_user_balances(db, user_account, interaction.guild.id)
-                
-                if not balances:
-                    embed = create_info_embed(
-                        "残高照会", 
-                        f"💰 あなたの残高\n\n現在保有している通貨はありません。", 
-                        interaction.user
-                    )
-                else:
-                    balance_text = ""
-                    for symbol, name, balance, decimals in balances:
-                        formatted_balance = format_currency_amount(balance, decimals)
-                        balance_text += f"• **{formatted_balance} {symbol}** ({name})\n"
-                    
-                    embed = create_info_embed(
-                        "残高照会",
-                        f"💰 あなたの残高\n\n{balance_text}",
-                        interaction.user
-                    )
-            
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        await interaction.response.send_message(embed=embed, ephemeral=True)
     
     @staticmethod
     async def give_currency_command(interaction: discord.Interaction, user: discord.Member, symbol: str, amount: float, memo: str = None):
@@ -670,60 +1091,61 @@ class VirtualCryptoCommands:
             embed = create_error_embed("入力エラー", "金額は正の数値を入力してください。", interaction.user)
             return await interaction.response.send_message(embed=embed, ephemeral=True)
         
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
-            
-            # 通貨情報取得
-            asset = await get_asset_by_symbol(db, interaction.guild.id, symbol)
-            if not asset:
-                embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
-                return await interaction.response.send_message(embed=embed, ephemeral=True)
-            
-            asset_id, symbol, asset_name, decimals = asset
-            
-            # 小数桁数調整
-            amount_decimal = amount_decimal.quantize(Decimal('0.1') ** decimals, rounding=ROUND_DOWN)
-            
-            # アカウント取得
-            treasury_account = await ensure_treasury_account(db, interaction.guild.id)
-            user_account = await ensure_user_account(db, user.id, interaction.guild.id)
-            
-            # Treasury残高チェック
-            treasury_balance = await balance_of(db, treasury_account, asset_id)
-            if treasury_balance < amount_decimal:
-                embed = create_error_embed(
-                    "残高不足",
-                    f"Treasury の残高が不足しています。\n\n"
-                    f"• 必要金額: {format_currency_amount(amount_decimal, decimals)} {symbol}\n"
-                    f"• Treasury残高: {format_currency_amount(treasury_balance, decimals)} {symbol}",
-                    interaction.user
-                )
-                return await interaction.response.send_message(embed=embed, ephemeral=True)
-            
-            # 発行実行
-            description = f"発行: Treasury → {user.display_name}"
-            if memo:
-                description += f" ({memo})"
-            
-            success = await transfer_currency(db, interaction.guild.id, treasury_account, user_account, asset_id, amount_decimal, description)
+        db = DB
+        gid = str(interaction.guild.id)
+        # 通貨情報・口座・Treasury残高を一括取得（口座が未作成の場合のみ作成して再取得）
+        user_name = f"user:{user.id}"
+        context = await get_transfer_context(db, gid, symbol, "treasury", user_name)
+        if context and (context[4] is None or context[5] is None):
+            await ensure_treasury_account(db, gid)
+            await ensure_user_accounts(db, gid, [user.id])
+            context = await get_transfer_context(db, gid, symbol, "treasury", user_name)
+        
+        if not context:
+            embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        asset_id, symbol, asset_name, decimals, treasury_account, user_account, treasury_balance = context
+        
+        # 小数桁数調整
+        amount_units = to_units(amount_decimal, decimals)
+        if amount_units > MAX_UNITS:
+            embed = create_error_embed("入力エラー", "金額が大きすぎます。", interaction.user)
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        # Treasury残高チェック
+        if treasury_balance < amount_units:
+            embed = create_error_embed(
+                "残高不足",
+                f"Treasury の残高が不足しています。\n\n"
+                f"• 必要金額: {format_units(amount_units, decimals)} {symbol}\n"
+                f"• Treasury残高: {format_units(treasury_balance, decimals)} {symbol}",
+                interaction.user
+            )
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        # 発行実行
+        description = f"発行: Treasury → {user.display_name}"
+        if memo:
+            description += f" ({memo})"
+        
+        success, message = await transfer_currency(db, gid, asset_id, [(treasury_account, user_account, amount_units)], description)
+        
+        if success:
+            embed = create_transaction_embed(
+                "通貨発行完了",
+                "🏦 Treasury",
+                user.mention,
+                format_units(amount_units, decimals),
+                symbol,
+                memo,
+                interaction.user
+            )
             
-            if success:
-                await db.commit()
-                
-                embed = create_transaction_embed(
-                    "通貨発行完了",
-                    "🏦 Treasury",
-                    user.mention,
-                    format_currency_amount(amount_decimal, decimals),
-                    symbol,
-                    memo,
-                    interaction.user
-                )
-                
-                await interaction.response.send_message(embed=embed, ephemeral=False)
-            else:
-                embed = create_error_embed("発行エラー", "通貨発行処理中にエラーが発生しました。", interaction.user)
-                await interaction.response.send_message(embed=embed, ephemeral=True)
+            await interaction.response.send_message(embed=embed, ephemeral=False)
+        else:
+            embed = create_error_embed("発行エラー", message, interaction.user)
+            await interaction.response.send_message(embed=embed, ephemeral=True)
     
     @staticmethod
     async def treasury_command(interaction: discord.Interaction, symbol: str = None, hidden: bool = True):
@@ -736,49 +1158,53 @@ class VirtualCryptoCommands:
             embed = create_error_embed("実行エラー", "このコマンドはサーバー内でのみ使用できます。", interaction.user)
             return await interaction.response.send_message(embed=embed, ephemeral=True)
         
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
+        db = DB
+        gid = str(interaction.guild.id)
+        if symbol:
+            # 通貨エラーは常に非公開で返すため、応答を保留する前に通貨を確認
+            asset = await get_asset_by_symbol(db, gid, symbol)
+            if not asset:
+                embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
+                return await interaction.response.send_message(embed=embed, ephemeral=True)
+        
+        # 残高の集計前に応答を保留し、3秒の応答期限を回避
+        await interaction.response.defer(ephemeral=hidden)
+        
+        if symbol:
+            # 特定通貨のTreasury残高
+            asset_id, symbol, asset_name, decimals = asset
+            treasury_account = await account_id_by_name(db, "treasury", gid)
+            balance = await balance_of(db, treasury_account, asset_id) if treasury_account else 0
             
-            if symbol:
-                # 特定通貨のTreasury残高
-                asset = await get_asset_by_symbol(db, interaction.guild.id, symbol)
-                if not asset:
-                    embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
-                    return await interaction.response.send_message(embed=embed, ephemeral=True)
-                
-                asset_id, symbol, asset_name, decimals = asset
-                treasury_account = await ensure_treasury_account(db, interaction.guild.id)
-                balance = await balance_of(db, treasury_account, asset_id)
-                
+            embed = create_info_embed(
+                "Treasury残高",
+                f"🏦 **Treasury** の {symbol} 残高\n\n"
+                f"**{format_units(balance, decimals)} {symbol}**",
+                interaction.user
+            )
+        else:
+            # 全通貨のTreasury残高
+            balances = await get_treasury_balances(db, gid)
+            
+            if not balances:
                 embed = create_info_embed(
-                    "Treasury残高",
-                    f"🏦 **Treasury** の {symbol} 残高\n\n"
-                    f"**{format_currency_amount(balance, decimals)} {symbol}**",
+                    "Treasury残高", 
+                    "🏦 **Treasury** の残高\n\n現在保有している通貨はありません。", 
                     interaction.user
                 )
             else:
-                # 全通貨のTreasury残高
-                balances = await get_treasury_balances(db, interaction.guild.id)
+                balance_text = "".join(
+                    f"• **{format_units(balance, decimals)} {symbol}** ({name})\n"
+                    for symbol, name, balance, decimals in balances
+                )
                 
-                if not balances:
-                    embed = create_info_embed(
-                        "Treasury残高", 
-                        "🏦 **Treasury** の残高\n\n現在保有している通貨はありません。", 
-                        interaction.user
-                    )
-                else:
-                    balance_text = ""
-                    for symbol, name, balance, decimals in balances:
-                        formatted_balance = format_currency_amount(balance, decimals)
-                        balance_text += f"• **{formatted_balance} {symbol}** ({name})\n"
-                    
-                    embed = create_info_embed(
-                        "Treasury残高",
-                        f"🏦 **Treasury** の残高\n\n{balance_text}",
-                        interaction.user
-                    )
-            
-            await interaction.response.send_message(embed=embed, ephemeral=hidden)
+                embed = create_info_embed(
+                    "Treasury残高",
+                    f"🏦 **Treasury** の残高\n\n{balance_text}",
+                    interaction.user
+                )
+        
+        await interaction.followup.send(embed=embed, ephemeral=hidden)
     
     # ランキング機能は削除
     
@@ -795,113 +1221,67 @@ class VirtualCryptoCommands:
         
         # デフォルト通貨の削除制限は削除
         
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
-            
-            # 通貨存在確認
-            asset = await get_asset_by_symbol(db, interaction.guild.id, symbol)
-            if not asset:
-                embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
-                return await interaction.response.send_message(embed=embed, ephemeral=True)
-            
-            asset_id, symbol, asset_name, decimals = asset
-            
-            # 残高チェック（全アカウント）
-            balances = await fetch_all(db, """
-                SELECT SUM(CAST(amount AS DECIMAL)) as total_balance
-                FROM ledger_entries 
-                WHERE asset_id = ?
-            """, (asset_id,))
-            
-            total_balance = balances[0][0] if balances and balances[0][0] else Decimal('0')
+        # DB処理の前に応答を保留し、3秒の応答期限を回避
+        await interaction.response.defer(ephemeral=True)
+        
+        db = DB
+        gid = str(interaction.guild.id)
+        # 通貨存在確認
+        asset = await get_asset_by_symbol(db, gid, symbol)
+        if not asset:
+            embed = create_error_embed("通貨エラー", f"通貨 '{symbol}' が見つかりません。", interaction.user)
+            return await interaction.followup.send(embed=embed, ephemeral=True)
+        
+        asset_id, symbol, asset_name, decimals = asset
+        
+        try:
+            # 残高チェックと削除を同じトランザクションで行う（チェック後の送金で残高が生じるのを防ぐ）
+            async with transaction(db):
+                # 全アカウントで残高がゼロなら削除可能
+                deletable = (await fetch_one(db, """
+                    SELECT NOT EXISTS(SELECT 1 FROM account_balances WHERE asset_id = ? AND balance <> 0)
+                """, (asset_id,)))[0]
+                
+                if deletable:
+                    # 関連データを削除
+                    await db.execute("DELETE FROM ledger_entries WHERE asset_id = ?", (asset_id,))
+                    await db.execute("DELETE FROM account_balances WHERE asset_id = ?", (asset_id,))
+                    await db.execute("DELETE FROM assets WHERE id = ?", (asset_id,))
             
-            if total_balance != 0:
+            if not deletable:
+                # 総残高はエラー表示のためだけに集計
+                total = await fetch_one(db, "SELECT COALESCE(SUM(balance), 0) FROM account_balances WHERE asset_id = ?", (asset_id,))
+                total_balance = total[0]
+                
                 embed = create_error_embed(
                     "削除エラー",
                     f"通貨 '{symbol}' は削除できません。\n\n"
                     f"削除条件:\n"
                     f"• 全アカウントで残高がゼロである必要があります\n"
-                    f"• 現在の総残高: {format_currency_amount(total_balance, decimals)} {symbol}",
+                    f"• 現在の総残高: {format_units(total_balance, decimals)} {symbol}",
                     interaction.user
                 )
-                return await interaction.response.send_message(embed=embed, ephemeral=True)
+                return await interaction.followup.send(embed=embed, ephemeral=True)
             
-            try:
-                # 関連データを削除
-                await db.execute("DELETE FROM ledger_entries WHERE asset_id = ?", (asset_id,))
-                await db.execute("DELETE FROM assets WHERE id = ?", (asset_id,))
-                await db.commit()
-                
-                embed = create_success_embed(
-                    "通貨削除完了",
-                    f"💥 通貨 **{symbol}** ({asset_name}) を削除しました。",
-                    interaction.user
-                )
-                
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-                
-            except Exception as e:
-                await db.rollback()
-                embed = create_error_embed("削除エラー", f"削除処理中にエラーが発生しました: {str(e)}", interaction.user)
-                await interaction.response.send_message(embed=embed, ephemeral=True)
+            _asset_cache.pop((gid, symbol), None)
+            _guild_assets_cache.pop(gid, None)
+            
+            embed = create_success_embed(
+                "通貨削除完了",
+                f"💥 通貨 **{symbol}** ({asset_name}) を削除しました。",
+                interaction.user
+            )
+            
+            await interaction.followup.send(embed=embed, ephemeral=True)
+            
+        except Exception as e:
+            embed = create_error_embed("削除エラー", f"削除処理中にエラーが発生しました: {str(e)}", interaction.user)
+            await interaction.followup.send(embed=embed, ephemeral=True)
     
     @staticmethod
     async def help_command(interaction: discord.Interaction):
         """ヘルプコマンドの処理"""
-        embed = create_info_embed(
-            "🏦 VirtualCrypto Bot ヘルプ",
-            "サーバー内独自通貨システムの使い方",
-            interaction.user
-        )
-        
-        # 一般ユーザー向けコマンド
-        embed.add_field(
-            name="👤 一般ユーザー向けコマンド",
-            value="**`/pay to:@ユーザー symbol:通貨 amount:金額 [memo:メモ]`**\n"
-                  "他のユーザーに通貨を送金します\n\n"
-                  "**`/bal [symbol:通貨]`**\n"
-                  "自分の残高を確認します（プライベート表示）\n"
-                  "• symbol省略時：全通貨の残高\n"
-                  "• symbol指定時：特定通貨のみ",
-            inline=False
-        )
-        
-        # 管理者専用コマンド
-        embed.add_field(
-            name="🛡️ 管理者専用コマンド",
-            value="**`/create symbol:通貨 name:通貨名 [decimals:小数桁] [initial_supply:初期供給量]`**\n"
-                  "新しい通貨を作成します\n\n"
-                  "**`/give user:@ユーザー symbol:通貨 amount:金額 [memo:理由]`**\n"
-                  "Treasuryから通貨を発行します\n\n"
-                  "**`/treasury [symbol:通貨] [hidden:非公開]`**\n"
-                  "Treasury残高を確認します\n\n"
-                  "**`/delete symbol:通貨`**\n"
-                  "通貨を削除します（全残高がゼロの場合のみ）",
-            inline=False
-        )
-        
-        # システムの特徴
-        embed.add_field(
-            name="💡 システムの特徴",
-            value="• **二重仕訳**: 正確な台帳管理で残高を保証\n"
-                  "• **サーバー独立**: 各サーバーで完全に独立した通貨システム\n"
-                  "• **オートコンプリート**: コマンド入力時に利用可能な通貨を表示\n"
-                  "• **権限管理**: 管理者コマンドは「サーバー管理」権限が必要\n"
-                  "• **透明性**: 送金は公開、残高確認は個人のみ表示",
-            inline=False
-        )
-        
-        # 使い方の例
-        embed.add_field(
-            name="📚 使い方の例",
-            value="1. 管理者が `/create symbol:GOLD name:ゴールドコイン decimals:2 initial_supply:10000` で通貨作成\n"
-                  "2. 管理者が `/give user:@ユーザー symbol:GOLD amount:100` でユーザーに配布\n"
-                  "3. ユーザーが `/pay to:@友達 symbol:GOLD amount:50 memo:ありがとう` で送金\n"
-                  "4. ユーザーが `/bal` で自分の残高確認\n"
-                  "5. 管理者が `/treasury symbol:GOLD` でTreasury残高確認",
-            inline=False
-        )
-        
+        embed = HELP_EMBED_TEMPLATE.copy()
         embed.set_footer(
             text="💰 VirtualCrypto Bot | 各コマンドの詳細はコマンド入力時に確認できます",
             icon_url=interaction.client.user.display_avatar.url if interaction.client.user else None
@@ -917,8 +1297,20 @@ intents.message_content = True
 intents.guilds = True
 intents.members = True
 
+class VirtualCryptoBot(commands.Bot):
+    """共有DB接続のライフサイクルを管理するBot"""
+    
+    async def setup_hook(self):
+        global DB
+        DB = await open_db()
+        print(f"[DB] Opened {DB_PATH}")
+    
+    async def close(self):
+        await super().close()
+        await close_db()
+
 # Bot初期化
-bot = commands.Bot(command_prefix='!', intents=intents)
+bot = VirtualCryptoBot(command_prefix='!', intents=intents)
 tree = bot.tree
 
 # ========================== Botイベント ==========================
@@ -926,7 +1318,6 @@ tree = bot.tree
 @bot.event
 async def on_ready():
     print(f"VirtualCrypto Bot がログインしました: {bot.user}")
-    await ensure_db()
     
     # Guild IDが指定されている場合は特定サーバーのみで同期
     guild_id = os.getenv("GUILD_ID")
@@ -938,12 +1329,16 @@ async def on_ready():
         await tree.sync()
         print("コマンドをグローバルに同期しました")
     
+    # 参加済みサーバーのシステムアカウントを用意しておく
+    for guild in bot.guilds:
+        await register_guild(DB, str(guild.id))
+    
     print("VirtualCrypto Bot の準備が完了しました！")
 
 @bot.event
 async def on_guild_join(guild):
     """新しいサーバーに参加した時の初期化"""
-    await ensure_db()
+    await register_guild(DB, str(guild.id))
     print(f"[JOIN] Joined guild {guild.name} ({guild.id}), ready to use")
 
 # ========================== スラッシュコマンド実装 ==========================
@@ -1015,23 +1410,24 @@ async def list_currencies(inter: discord.Interaction):
         return await inter.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
     
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            assets = await get_guild_assets(db, inter.guild.id)
-            
-            if not assets:
-                embed = create_info_embed("通貨一覧", "このサーバーには通貨が作成されていません。", inter.user)
-            else:
-                description = []
-                for asset_id, symbol, name, decimals in assets:
-                    description.append(f"**{symbol}** - {name} (小数桁: {decimals})")
-                
-                embed = create_info_embed(
-                    "通貨一覧",
-                    f"このサーバーの全通貨 ({len(assets)}個):\n\n" + "\n".join(description),
-                    inter.user
-                )
+        db = DB
+        gid = str(inter.guild.id)
+        assets = await get_guild_assets(db, gid)
+        
+        if not assets:
+            embed = create_info_embed("通貨一覧", "このサーバーには通貨が作成されていません。", inter.user)
+        else:
+            description = []
+            for asset_id, symbol, name, decimals in assets:
+                description.append(f"**{symbol}** - {name} (小数桁: {decimals})")
             
-            await inter.response.send_message(embed=embed, ephemeral=True)
+            embed = create_info_embed(
+                "通貨一覧",
+                f"このサーバーの全通貨 ({len(assets)}個):\n\n" + "\n".join(description),
+                inter.user
+            )
+        
+        await inter.response.send_message(embed=embed, ephemeral=True)
     except Exception as e:
         await inter.response.send_message(f"エラーが発生しました: {str(e)}", ephemeral=True)
 
@@ -1060,81 +1456,96 @@ async def fix_database(inter: discord.Interaction, confirm: str, symbol: str = N
         )
         return await inter.response.send_message(embed=embed, ephemeral=True)
     
+    # DB処理の前に応答を保留し、3秒の応答期限を回避
+    await inter.response.defer(ephemeral=True)
+    
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await ensure_db()
-            
-            # Treasury残高の修復
-            treasury_account = await ensure_treasury_account(db, inter.guild.id)
-            
-            if symbol:
-                # 特定通貨の修復
-                asset = await get_asset_by_symbol(db, inter.guild.id, symbol)
-                if not asset:
-                    return await inter.response.send_message(f"通貨 '{symbol}' が見つかりません。", ephemeral=True)
-                
-                asset_id, symbol, asset_name, decimals = asset
-                assets_to_fix = [(asset_id, symbol, asset_name, decimals)]
-            else:
-                # 全通貨の修復
-                assets_to_fix = await get_guild_assets(db, inter.guild.id)
+        db = DB
+        gid = str(inter.guild.id)
+        # Treasury残高の修復
+        treasury_account = await ensure_treasury_account(db, gid)
+        
+        if symbol:
+            # 特定通貨の修復
+            asset = await get_asset_by_symbol(db, gid, symbol)
+            if not asset:
+                return await inter.followup.send(f"通貨 '{symbol}' が見つかりません。", ephemeral=True)
             
-            fixed_currencies = []
+            asset_id, symbol, asset_name, decimals = asset
+            assets_to_fix = [(asset_id, symbol, asset_name, decimals)]
+        else:
+            # 全通貨の修復
+            assets_to_fix = await get_guild_assets(db, gid)
+        
+        fixed_currencies = []
+        skipped_currencies = []
+        adjustments = []
+        
+        async with transaction(db):
+            # Treasury残高と全ユーザーの残高合計を台帳から通貨ごとに一括計算
+            # （残高キャッシュのずれも修復対象のため、両方とも ledger_entries を正とする）
+            totals = {
+                asset_id: (treasury_total, users_total)
+                for asset_id, treasury_total, users_total in await fetch_all(db, """
+                    SELECT 
+                        le.asset_id,
+                        SUM(CASE WHEN a.id = ? THEN le.amount ELSE 0 END),
+                        SUM(CASE WHEN a.type = 'user' THEN le.amount ELSE 0 END)
+                    FROM accounts a
+                    JOIN ledger_entries le ON le.account_id = a.id
+                    WHERE a.guild_id = ?
+                    GROUP BY le.asset_id
+                """, (treasury_account, gid))
+            }
             
             for asset_id, curr_symbol, asset_name, decimals in assets_to_fix:
-                # 現在のTreasury残高を計算
-                treasury_balance = await balance_of(db, treasury_account, asset_id)
-                
-                # 全ユーザーの残高合計を計算
-                users_total = await fetch_one(db, """
-                    SELECT COALESCE(SUM(CAST(le.amount AS DECIMAL)), 0) as total
-                    FROM ledger_entries le
-                    JOIN accounts a ON le.account_id = a.id
-                    WHERE le.asset_id = ? AND a.type = 'user' AND a.guild_id = ?
-                """, (asset_id, str(inter.guild.id)))
-                
-                users_balance = Decimal(users_total[0] if users_total and users_total[0] else '0')
+                treasury_balance, users_balance = totals.get(asset_id, (0, 0))
                 
                 # Treasury残高を正の値に調整（ユーザー残高をカバーできる分 + 1000000）
-                target_treasury_balance = users_balance + Decimal('1000000')
+                target_treasury_balance = users_balance + to_units(Decimal('1000000'), decimals)
                 adjustment = target_treasury_balance - treasury_balance
                 
+                # 小数桁数の大きい旧通貨はINTEGERに収まらないため修復しない
+                if target_treasury_balance > MAX_UNITS or abs(adjustment) > MAX_UNITS:
+                    skipped_currencies.append(f"• **{curr_symbol}**")
+                    continue
+                
                 if adjustment != 0:
-                    # 調整エントリを追加
-                    cursor = await db.execute("""
-                        INSERT INTO transactions (guild_id, description, created_at) 
-                        VALUES (?, ?, ?)
-                    """, (str(inter.guild.id), f"DB修復: {curr_symbol} Treasury残高調整", datetime.now(TZ).isoformat()))
-                    
-                    transaction_id = cursor.lastrowid
-                    
-                    await db.execute("""
-                        INSERT INTO ledger_entries (transaction_id, account_id, asset_id, amount) 
-                        VALUES (?, ?, ?, ?)
-                    """, (transaction_id, treasury_account, asset_id, str(adjustment)))
-                    
-                    fixed_currencies.append(f"• **{curr_symbol}**: {format_currency_amount(adjustment, decimals)} 調整")
-            
-            await db.commit()
-            
-            if fixed_currencies:
-                embed = create_success_embed(
-                    "データベース修復完了",
-                    f"以下の通貨が修復されました:\n\n" + "\n".join(fixed_currencies),
-                    inter.user
-                )
-            else:
-                embed = create_info_embed(
-                    "データベース修復完了",
-                    "修復が必要な通貨はありませんでした。",
-                    inter.user
-                )
-            
-            await inter.response.send_message(embed=embed, ephemeral=True)
+                    adjustments.append((curr_symbol, asset_id, adjustment))
+                    fixed_currencies.append(f"• **{curr_symbol}**: {format_units(adjustment, decimals)} 調整")
             
+            if adjustments:
+                # 調整エントリを1つの取引にまとめて追加
+                symbols = ", ".join(curr_symbol for curr_symbol, _, _ in adjustments)
+                transaction_id = (await fetch_one(db, SQL_INSERT_TRANSACTION, (gid, f"DB修復: {symbols} Treasury残高調整")))[0]
+                
+                await db.executemany(SQL_INSERT_LEDGER_ENTRY, [
+                    (transaction_id, treasury_account, asset_id, adjustment)
+                    for _, asset_id, adjustment in adjustments
+                ])
+        
+        sections = []
+        if fixed_currencies:
+            sections.append("以下の通貨が修復されました:\n\n" + "\n".join(fixed_currencies))
+        if skipped_currencies:
+            sections.append("以下の通貨は調整額が大きすぎるため修復できませんでした:\n\n" + "\n".join(skipped_currencies))
+        
+        if fixed_currencies:
+            embed = create_success_embed("データベース修復完了", "\n\n".join(sections), inter.user)
+        elif skipped_currencies:
+            embed = create_error_embed("修復エラー", "\n\n".join(sections), inter.user)
+        else:
+            embed = create_info_embed(
+                "データベース修復完了",
+                "修復が必要な通貨はありませんでした。",
+                inter.user
+            )
+        
+        await inter.followup.send(embed=embed, ephemeral=True)
+        
     except Exception as e:
         embed = create_error_embed("修復エラー", f"データベース修復中にエラーが発生しました: {str(e)}", inter.user)
-        await inter.response.send_message(embed=embed, ephemeral=True)
+        await inter.followup.send(embed=embed, ephemeral=True)
 
 # ========================== オートコンプリート ==========================
 
@@ -1145,30 +1556,29 @@ async def pay_symbol_autocomplete(interaction: discord.Interaction, current: str
         return []
     
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            # サーバーの全通貨を取得
-            assets = await get_guild_assets(db, interaction.guild.id)
-            user_account = await ensure_user_account(db, interaction.user.id, interaction.guild.id)
-            
-            choices = []
-            for asset_id, symbol, name, decimals in assets:
-                if current.lower() in symbol.lower() or current.lower() in name.lower():
-                    # ユーザーの残高を取得
-                    balance = await balance_of(db, user_account, asset_id)
-                    balance_str = format_currency_amount(balance, decimals)
-                    
-                    if balance > 0:
-                        choices.append(app_commands.Choice(
-                            name=f"{symbol} - {balance_str} 所有",
-                            value=symbol
-                        ))
-                    else:
-                        choices.append(app_commands.Choice(
-                            name=f"{symbol} - {name} (残高なし)",
-                            value=symbol
-                        ))
+        db = DB
+        gid = str(interaction.guild.id)
+        # 入力のたびに口座を作成しないよう参照のみ（口座がなければ全て残高0）
+        user_account = await account_id_by_name(db, f"user:{interaction.user.id}", gid)
+        # 入力に一致する通貨とユーザーの残高をSQL側で絞り込んで取得（Discordの上限25件）
+        assets = await search_guild_assets_with_user_balance(db, gid, user_account, current, 25)
+        
+        choices = []
+        for asset_id, symbol, name, decimals, balance in assets:
+            balance_str = format_units(balance, decimals)
             
-            return choices[:25]  # Discord limit
+            if balance > 0:
+                choices.append(app_commands.Choice(
+                    name=f"{symbol} - {balance_str} 所有",
+                    value=symbol
+                ))
+            else:
+                choices.append(app_commands.Choice(
+                    name=f"{symbol} - {name} (残高なし)",
+                    value=symbol
+                ))
+        
+        return choices
     except Exception as e:
         return []
 
@@ -1260,18 +1670,19 @@ async def general_symbol_autocomplete(interaction: discord.Interaction, current:
         return []
     
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            assets = await get_guild_assets(db, interaction.guild.id)
-            
-            choices = []
-            for asset_id, symbol, name, decimals in assets:
-                if current.lower() in symbol.lower() or current.lower() in name.lower():
-                    choices.append(app_commands.Choice(
-                        name=f"{symbol} - {name}",
-                        value=symbol
-                    ))
-            
-            return choices[:25]  # Discord limit
+        db = DB
+        gid = str(interaction.guild.id)
+        assets = await get_guild_assets(db, gid)
+        
+        choices = []
+        for asset_id, symbol, name, decimals in assets:
+            if current.lower() in symbol.lower() or current.lower() in name.lower():
+                choices.append(app_commands.Choice(
+                    name=f"{symbol} - {name}",
+                    value=symbol
+                ))
+        
+        return choices[:25]  # Discord limit
     except Exception as e:
         return []
 